@@ -4,9 +4,14 @@ Handles file uploads, OCR extraction, AI analysis, and Firebase integration
 """
 
 import os
+import tempfile
 import uuid
-from datetime import datetime
-from flask import Flask, request, jsonify
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from threading import Lock
+from cachetools import TTLCache
+import zstandard as zstd
+from flask import Flask, Request, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import firebase_admin
@@ -15,7 +20,7 @@ from google.cloud.firestore_v1.base_query import FieldFilter
 from dotenv import load_dotenv
 
 # Import utility functions
-from utils import process_uploaded_file
+from utils import is_generated_analysis, process_uploaded_file, text_fingerprint
 
 # Load environment variables
 load_dotenv()
@@ -45,6 +50,57 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+
+class StreamingUploadRequest(Request):
+    """
+    Request that spools uploaded files straight into UPLOAD_FOLDER
+    
+    Werkzeug writes each file part of the multipart body into a temporary
+    file inside the upload folder, so saving the upload later is a rename
+    rather than another copy of the whole file.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_upload_paths = []
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile(dir=UPLOAD_FOLDER, suffix='.part', delete=False)
+        self.spooled_upload_paths.append(stream.name)
+        return stream
+
+
+app.request_class = StreamingUploadRequest
+
+# Background workers for the OCR -> AI -> Firestore pipeline, so uploads
+# return immediately instead of holding a request thread during processing
+executor = ThreadPoolExecutor(max_workers=4)
+
+# Threads for short blocking I/O calls (signed URLs, storage) run in parallel
+io_executor = ThreadPoolExecutor(max_workers=16)
+
+# Signed URLs are valid for 15 minutes; reuse them for 13 so a cached URL
+# always has time left when the client follows it
+SIGNED_URL_EXPIRATION = timedelta(minutes=15)
+_URL_CACHE = TTLCache(maxsize=10000, ttl=13 * 60)
+_URL_CACHE_LOCK = Lock()
+
+# Fields returned by the report list; the full extracted text and AI analysis
+# are only fetched by the report detail endpoint
+REPORT_LIST_FIELDS = ['filename', 'uploaded_at', 'blob_path', 'status', 'ai_preview']
+AI_PREVIEW_LENGTH = 150
+
+# Reports still "processing" after this long are reported as failed; jobs only
+# live in the in-memory executor and are lost if the server restarts
+PROCESSING_TIMEOUT = timedelta(minutes=15)
+
+# Large text fields are stored zstd-compressed under "<field>_z" to cut
+# Firestore storage and read bandwidth; small values are stored as-is
+COMPRESSED_FIELDS = ('extracted_text', 'ai_analysis')
+COMPRESSION_THRESHOLD = 1024
+_ZC = zstd.ZstdCompressor(level=3)
+_ZD = zstd.ZstdDecompressor()
+
 # Initialize Firebase Admin SDK
 try:
     # Using Firebase credentials from environment variables
@@ -122,6 +178,23 @@ def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def save_uploaded_file(file, file_path: str) -> None:
+    """
+    Move an uploaded file to its final path
+    
+    Args:
+        file: Uploaded FileStorage from the request
+        file_path: Destination path inside UPLOAD_FOLDER
+    """
+    spooled_path = getattr(file.stream, 'name', None)
+    if isinstance(spooled_path, str) and os.path.exists(spooled_path):
+        # Already on disk in the upload folder; just rename it into place
+        file.stream.flush()
+        os.replace(spooled_path, file_path)
+    else:
+        file.save(file_path)
+
+
 def upload_to_firebase_storage(local_file_path: str, filename: str, user_id: str) -> str:
     """
     Upload file to Firebase Storage and return blob path
@@ -159,35 +232,104 @@ def generate_signed_url(blob_path: str) -> str:
         blob_path: Path to blob in Firebase Storage
         
     Returns:
-        Signed URL valid for 15 minutes
+        Signed URL valid for 15 minutes (cached URLs are reused for up to 13)
     """
     try:
         if not bucket or not blob_path:
             return ""
         
-        from datetime import timedelta
+        with _URL_CACHE_LOCK:
+            cached_url = _URL_CACHE.get(blob_path)
+        if cached_url:
+            return cached_url
+        
         blob = bucket.blob(blob_path)
         
         # Generate signed URL valid for 15 minutes
         signed_url = blob.generate_signed_url(
             version="v4",
-            expiration=timedelta(minutes=15),
+            expiration=SIGNED_URL_EXPIRATION,
             method="GET"
         )
         
+        with _URL_CACHE_LOCK:
+            _URL_CACHE[blob_path] = signed_url
         return signed_url
     except Exception as e:
         print(f"Signed URL generation error: {str(e)}")
         return ""
 
 
-def save_report_to_firestore(user_id: str, report_data: dict) -> str:
+def compress_report_fields(report_data: dict) -> dict:
+    """
+    Replace large text fields with zstd-compressed bytes
+    
+    Args:
+        report_data: Report fields about to be written to Firestore
+        
+    Returns:
+        Copy of report_data with each large field moved to "<field>_z"
+    """
+    report_data = dict(report_data)
+    for field in COMPRESSED_FIELDS:
+        value = report_data.get(field)
+        if isinstance(value, str):
+            encoded = value.encode('utf-8')
+            if len(encoded) > COMPRESSION_THRESHOLD:
+                report_data[f"{field}_z"] = _ZC.compress(encoded)
+                del report_data[field]
+    return report_data
+
+
+def decompress_report_fields(report_data: dict) -> dict:
+    """
+    Restore text fields stored compressed by compress_report_fields
+    
+    Args:
+        report_data: Report fields read from Firestore (modified in place)
+        
+    Returns:
+        report_data with every "<field>_z" decompressed back into "<field>"
+    """
+    for field in COMPRESSED_FIELDS:
+        compressed = report_data.pop(f"{field}_z", None)
+        if compressed is not None:
+            report_data[field] = _ZD.decompress(compressed).decode('utf-8')
+    return report_data
+
+
+def expire_stale_report(report_data: dict) -> dict:
+    """
+    Report a job stuck in "processing" past PROCESSING_TIMEOUT as failed
+    
+    Args:
+        report_data: Report fields read from Firestore (modified in place)
+        
+    Returns:
+        report_data, with status "error" if its processing job was lost
+    """
+    if report_data.get('status') != 'processing':
+        return report_data
+    
+    try:
+        uploaded_at = datetime.fromisoformat(report_data.get('uploaded_at', ''))
+    except (TypeError, ValueError):
+        return report_data
+    
+    if datetime.utcnow() - uploaded_at > PROCESSING_TIMEOUT:
+        report_data['status'] = 'error'
+        report_data['error'] = "Processing did not complete. Please upload the file again."
+    return report_data
+
+
+def save_report_to_firestore(user_id: str, report_data: dict, report_id: str = None) -> str:
     """
     Save report data to Firestore
     
     Args:
         user_id: User's Firebase UID
         report_data: Dictionary containing report information
+        report_id: Existing report to merge the data into (creates a new report if omitted)
         
     Returns:
         Document ID of saved report
@@ -196,14 +338,127 @@ def save_report_to_firestore(user_id: str, report_data: dict) -> str:
         if not db:
             raise Exception("Database not available")
         
-        doc_ref = db.collection('users').document(user_id).collection('reports').document()
-        doc_ref.set(report_data)
+        report_data = compress_report_fields(report_data)
+        reports_ref = db.collection('users').document(user_id).collection('reports')
+        if report_id:
+            doc_ref = reports_ref.document(report_id)
+            doc_ref.set(report_data, merge=True)
+        else:
+            doc_ref = reports_ref.document()
+            doc_ref.set(report_data)
         return doc_ref.id
     except Exception as e:
         print(f"Firestore save error: {str(e)}")
         raise Exception(f"Failed to save report to database: {str(e)}")
 
 
+def find_existing_analysis(user_id: str, text_hash: str) -> str:
+    """
+    Look up the AI analysis of an earlier report with identical extracted text
+    
+    Only reports whose analysis was actually generated are matched, so fallback
+    error messages are never reused.
+    
+    Args:
+        user_id: User's Firebase UID
+        text_hash: Fingerprint of the extracted text
+        
+    Returns:
+        AI analysis of the matching report, or an empty string if none exists
+    """
+    try:
+        if not db:
+            return ""
+        
+        matches = (
+            db.collection('users').document(user_id).collection('reports')
+            .where(filter=FieldFilter('text_hash', '==', text_hash))
+            .where(filter=FieldFilter('analysis_ok', '==', True))
+            .limit(1)
+            .get()
+        )
+        if not matches:
+            return ""
+        
+        report_data = decompress_report_fields(matches[0].to_dict())
+        return report_data.get('ai_analysis', "")
+    except Exception as e:
+        print(f"Duplicate report lookup warning: {str(e)}")
+        return ""
+
+
+def collect_blob_path(storage_future: Future) -> str:
+    """
+    Wait for the storage upload started alongside OCR and return its blob path
+    
+    Args:
+        storage_future: Running upload_to_firebase_storage call for the file
+        
+    Returns:
+        Blob path of the uploaded file, or an empty string if the upload failed
+    """
+    try:
+        return storage_future.result()
+    except Exception as e:
+        print(f"Storage upload warning: {str(e)}")
+        return ""
+
+
+def process_report_pipeline(file_path: str, file_extension: str, user_id: str,
+                            report_id: str, storage_future: Future) -> None:
+    """
+    Run OCR and AI analysis for a report in the background
+    
+    The storage upload runs concurrently in storage_future; its blob path is
+    collected just before the results are saved. AI analysis is skipped when
+    the user already has a report with the same extracted text; its analysis
+    is reused instead. Updates the report document to status "done" with the
+    results, or to status "error" with an error message if processing fails.
+    The blob path is recorded in both cases so the stored file stays reachable.
+    
+    Args:
+        file_path: Path to the temporarily saved upload
+        file_extension: File extension (pdf, png, jpg, jpeg, gif)
+        user_id: User's Firebase UID
+        report_id: Document ID of the pending report
+        storage_future: Running upload_to_firebase_storage call for the file
+    """
+    try:
+        extracted_text, ai_analysis = process_uploaded_file(
+            file_path, file_extension,
+            lambda text_hash: find_existing_analysis(user_id, text_hash),
+            user_id
+        )
+        
+        blob_path = collect_blob_path(storage_future)
+        # Only fingerprint reports with a real analysis so errors are not reused
+        analysis_ok = bool(extracted_text) and is_generated_analysis(ai_analysis)
+        save_report_to_firestore(user_id, {
+            "status": "done",
+            "blob_path": blob_path,  # Store blob path, not signed URL
+            "extracted_text": extracted_text,
+            "ai_analysis": ai_analysis,
+            "ai_preview": ai_analysis[:AI_PREVIEW_LENGTH],
+            "analysis_ok": analysis_ok,
+            "text_hash": text_fingerprint(extracted_text) if analysis_ok else ""
+        }, report_id)
+    except Exception as e:
+        print(f"Report processing error: {str(e)}")
+        try:
+            save_report_to_firestore(user_id, {
+                "status": "error",
+                "blob_path": collect_blob_path(storage_future),
+                "error": f"Processing failed: {str(e)}"
+            }, report_id)
+        except Exception as save_error:
+            print(f"Firestore status update warning: {str(save_error)}")
+    finally:
+        # Clean up temporary file once the storage upload is no longer reading it
+        wait([storage_future])
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
 @app.route('/', methods=['GET'])
 def index():
     """Health check endpoint"""
@@ -222,14 +477,15 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """
-    Handle file upload, extract text using OCR, and analyze with AI
+    Accept a file upload and queue it for OCR and AI analysis
     
     Request:
         - Authorization header with Firebase ID token (required)
         - file: PDF or image file
         
     Returns:
-        JSON with filename, extracted_text, ai_analysis, and report_id
+        202 with report_id and status "processing"; poll GET /report/<report_id>
+        until status is "done" (or "error")
     """
     try:
         # Authenticate user
@@ -238,6 +494,9 @@ def upload_file():
         except Exception as e:
             return jsonify({"error": str(e)}), 401
         
+        if not db:
+            return jsonify({"error": "Database not available"}), 503
+        
         # Validate file in request
         if 'file' not in request.files:
             return jsonify({"error": "No file provided"}), 400
@@ -260,54 +519,37 @@ def upload_file():
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
         
         # Save file temporarily
-        file.save(file_path)
+        save_uploaded_file(file, file_path)
         
-        # Process file: extract text and get AI analysis
+        # Create the report up front so clients can poll its status
         try:
-            extracted_text, ai_analysis = process_uploaded_file(file_path, file_extension)
+            report_id = save_report_to_firestore(user_id, {
+                "filename": original_filename,
+                "blob_path": "",
+                "status": "processing",
+                "uploaded_at": datetime.utcnow().isoformat(),
+                "user_id": user_id
+            })
         except Exception as e:
-            # Clean up temporary file
             if os.path.exists(file_path):
                 os.remove(file_path)
-            return jsonify({"error": f"Processing failed: {str(e)}"}), 500
-        
-        # Upload to Firebase Storage if available
-        blob_path = ""
-        if bucket:
-            try:
-                blob_path = upload_to_firebase_storage(file_path, unique_filename, user_id)
-            except Exception as e:
-                print(f"Storage upload warning: {str(e)}")
-        
-        # Save to Firestore if available
-        report_id = ""
-        if db:
-            try:
-                report_data = {
-                    "filename": original_filename,
-                    "blob_path": blob_path,  # Store blob path, not signed URL
-                    "extracted_text": extracted_text,
-                    "ai_analysis": ai_analysis,
-                    "uploaded_at": datetime.utcnow().isoformat(),
-                    "user_id": user_id
-                }
-                report_id = save_report_to_firestore(user_id, report_data)
-            except Exception as e:
-                print(f"Firestore save warning: {str(e)}")
-        
-        # Clean up temporary file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+            return jsonify({"error": str(e)}), 500
+        
+        # Upload to Firebase Storage while the file is processed
+        storage_future = io_executor.submit(upload_to_firebase_storage, file_path, unique_filename, user_id)
+        
+        # Process file in the background: extract text, get AI analysis, store results
+        executor.submit(process_report_pipeline, file_path, file_extension,
+                        user_id, report_id, storage_future)
         
-        # Return response
         return jsonify({
             "success": True,
             "filename": original_filename,
-            "extracted_text": extracted_text,
-            "ai_analysis": ai_analysis,
             "report_id": report_id,
-            "message": "File processed successfully"
-        }), 200
+            "user_id": user_id,
+            "status": "processing",
+            "message": "File accepted for processing"
+        }), 202
         
     except Exception as e:
         return jsonify({"error": f"Upload failed: {str(e)}"}), 500
@@ -325,7 +567,8 @@ def get_user_reports(user_id):
         limit: Maximum number of reports to return (default: 50)
         
     Returns:
-        JSON array of user's reports sorted by upload date (newest first)
+        JSON array of user's report summaries sorted by upload date (newest first);
+        use GET /report/<report_id> for the extracted text and full AI analysis
     """
     try:
         # Authenticate user
@@ -347,19 +590,24 @@ def get_user_reports(user_id):
         
         # Query Firestore for user's reports
         reports_ref = db.collection('users').document(user_id).collection('reports')
-        query = reports_ref.order_by('uploaded_at', direction=firestore.Query.DESCENDING).limit(limit)
+        query = (
+            reports_ref.select(REPORT_LIST_FIELDS)
+            .order_by('uploaded_at', direction=firestore.Query.DESCENDING)
+            .limit(limit)
+        )
         
         reports = []
         for doc in query.stream():
-            report_data = doc.to_dict()
+            report_data = expire_stale_report(doc.to_dict())
             report_data['report_id'] = doc.id
-            
-            # Generate fresh signed URL for file access (if blob_path exists)
-            if 'blob_path' in report_data and report_data['blob_path']:
-                report_data['file_url'] = generate_signed_url(report_data['blob_path'])
-            
             reports.append(report_data)
         
+        # Generate fresh signed URLs for file access (if blob_path exists) in parallel
+        reports_with_files = [r for r in reports if r.get('blob_path')]
+        signed_urls = io_executor.map(generate_signed_url, [r['blob_path'] for r in reports_with_files])
+        for report_data, signed_url in zip(reports_with_files, signed_urls):
+            report_data['file_url'] = signed_url
+        
         return jsonify({
             "success": True,
             "user_id": user_id,
@@ -383,7 +631,8 @@ def get_report_detail(report_id):
         user_id: Firebase user ID (required for security)
         
     Returns:
-        JSON with complete report details including AI analysis
+        JSON with complete report details including AI analysis and processing
+        status ("processing", "done" or "error")
     """
     try:
         # Authenticate user
@@ -411,7 +660,7 @@ def get_report_detail(report_id):
         if not doc.exists:
             return jsonify({"error": "Report not found"}), 404
         
-        report_data = doc.to_dict()
+        report_data = expire_stale_report(decompress_report_fields(doc.to_dict()))
         report_data['report_id'] = doc.id
         
         # Generate fresh signed URL for file access (if blob_path exists)
@@ -427,6 +676,14 @@ def get_report_detail(report_id):
         return jsonify({"error": f"Failed to retrieve report: {str(e)}"}), 500
 
 
+@app.teardown_request
+def remove_spooled_uploads(e):
+    """Delete spooled upload files that were not moved into place"""
+    for path in getattr(request, 'spooled_upload_paths', []):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 @app.errorhandler(413)
 def file_too_large(e):
     """Handle file size limit exceeded"""
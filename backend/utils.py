@@ -1,19 +1,39 @@
 """
 Utility functions for OCR text extraction and AI analysis
-Handles PDF to image conversion, image text extraction, and Gemini AI integration
+Handles PDF page rendering, image text extraction, and Gemini AI integration
 """
 
+import asyncio
+import atexit
+import io
+import multiprocessing
+import multiprocessing.util
 import os
+import re
+import string
 import tempfile
-from typing import Tuple, Optional
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Condition, Lock, Thread
+from typing import Awaitable, Callable, Iterator, List, Tuple, Optional
 from PIL import Image
-import pytesseract
-from pdf2image import convert_from_path
+import cv2
+import numpy as np
+from tesserocr import PyTessBaseAPI, PSM, OEM
+import fitz
+from cachetools import TTLCache
+from blake3 import blake3
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
 load_dotenv()
+
+# Tesseract spawns its own OpenMP threads; keep each OCR worker process single-threaded
+# so parallel page OCR does not oversubscribe the CPU cores
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 # Initialize Gemini client
 # IMPORTANT: Using python_gemini integration
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
@@ -23,13 +43,129 @@ if GEMINI_API_KEY:
 else:
     print("⚠️  Warning: GEMINI_API_KEY not set. AI analysis will not be available.")
 
+# Resolution used when rendering PDF pages for OCR
+PDF_RENDER_DPI = 150
+
+# Number of PDF pages rendered and OCR'd at a time, bounding peak memory
+PDF_PAGE_CHUNK_SIZE = 10
+
+# A PDF page's embedded text layer is used instead of OCR when it has at least
+# this many characters, drawn from at least this many distinct letters/digits
+MIN_TEXT_LAYER_CHARS = 50
+MIN_TEXT_LAYER_DISTINCT_CHARS = 10
+
+# Tesseract settings: LSTM engine, one uniform block of text (skips orientation
+# detection and page layout analysis), English only
+TESSERACT_LANG = "eng"
+TESSERACT_PSM = PSM.SINGLE_BLOCK
+TESSERACT_OEM = OEM.LSTM_ONLY
+TESSERACT_VARIABLES = {"preserve_interword_spaces": "1"}
+
+# Uploaded images larger than this (longest side, in pixels) are downscaled before OCR
+MAX_IMAGE_DIMENSION = 2200
+
+# Images below this pixel area, or with a Laplacian variance (sharpness) below
+# this value, are rejected before OCR as unreadable
+MIN_IMAGE_PIXELS = 50000
+MIN_IMAGE_SHARPNESS = 30
+
+# Cache of AI analyses keyed by a hash of the submitted text, so re-uploads of
+# the same document skip the Gemini round-trip (entries expire after 10 minutes)
+_AI_CACHE = TTLCache(maxsize=1024, ttl=600)
+_AI_LOCK = Lock()
+
+GEMINI_MODEL = "gemini-1.5-flash"
+
+AI_DISCLAIMER = "⚠️ This is an AI-generated analysis for informational purposes only. It is NOT medical advice. Always consult with your healthcare provider for proper interpretation and clinical decisions."
+
+# Phrase every complete analysis must contain (checked case-insensitively)
+AI_DISCLAIMER_MARKER = "for informational purposes only"
+
+# System instruction with safety disclaimer
+SYSTEM_INSTRUCTION = f"""You are a medical AI assistant helping patients understand their medical reports and prescriptions.
+
+IMPORTANT DISCLAIMER: You must always include this in your response:
+"{AI_DISCLAIMER}"
+
+Your role is to help patients understand their medical documents, not to diagnose or prescribe treatment."""
+
+# Prompt scaffold shared by every analysis request; cached server-side together
+# with the system instruction when Gemini context caching is available
+PROMPT_TEMPLATE_PREFIX = """Analyze the following medical text and provide a clear, patient-friendly explanation that includes:
+
+1. **Document Type**: Identify if this is a lab report, prescription, radiology report, etc.
+2. **Key Findings**: List the main test results, medications, or findings
+3. **Normal vs Abnormal**: Highlight any values that are outside normal ranges (if applicable)
+4. **Simple Explanation**: Explain what these results mean in simple, non-technical language
+5. **Recommendations**: Suggest next steps (e.g., "discuss with your doctor", "this appears normal")
 
-def extract_text_from_image(image_path: str) -> str:
+Remember to include the important disclaimer at the end of your analysis."""
+
+DOCUMENT_PROMPT = """Medical Text:
+{extracted_text}"""
+
+# Prompt for analyzing several independent documents in one request
+BATCH_SEPARATOR = "<<<SEP>>>"
+BATCH_DOCUMENT_PROMPT = """The following {count} medical texts are independent reports. Analyze each one separately as described, and output the analyses in the same order, separated by a line containing only {separator}. Do not put the separator before the first analysis or after the last one. Every analysis must end with the disclaimer.
+
+{reports}"""
+
+# Messages returned in place of an analysis when Gemini produced none; these
+# must never be reused for another upload of the same document
+AI_UNAVAILABLE_MESSAGE = "⚠️ AI analysis is not available. GEMINI_API_KEY is not configured. Please set up the API key to enable AI-powered medical report analysis."
+INSUFFICIENT_TEXT_MESSAGE = "Unable to analyze: insufficient text extracted from the document."
+NO_ANALYSIS_MESSAGE = "AI analysis could not be generated. Please try again or consult your healthcare provider."
+RATE_LIMITED_MESSAGE = "Service temporarily unavailable due to high demand. Please try again in a few moments."
+API_CONFIG_ERROR_MESSAGE = "API configuration error. Please contact support."
+DOCUMENT_TOO_LARGE_MESSAGE = "Document is too large to analyze. Please try a shorter document or split it into sections."
+FALLBACK_ANALYSES = frozenset((
+    AI_UNAVAILABLE_MESSAGE,
+    INSUFFICIENT_TEXT_MESSAGE,
+    NO_ANALYSIS_MESSAGE,
+    RATE_LIMITED_MESSAGE,
+    API_CONFIG_ERROR_MESSAGE,
+    DOCUMENT_TOO_LARGE_MESSAGE,
+))
+
+# Gemini context caching is opt-in: the shared prompt is well below the
+# minimum cacheable size unless it is extended, and caching requires an
+# explicitly versioned model
+CONTEXT_CACHE_ENABLED = os.environ.get("GEMINI_CONTEXT_CACHE", "False").lower() in ("true", "1", "t")
+CONTEXT_CACHE_MODEL = os.environ.get("GEMINI_CONTEXT_CACHE_MODEL", "gemini-1.5-flash-002")
+CONTEXT_CACHE_TTL_SECONDS = 3600
+_context_cache_failed = False
+_context_cache_name = None
+_context_cache_expires_at = 0.0
+_context_cache_lock = asyncio.Lock()
+
+# Event loop (run in a background thread) for async Gemini requests, so
+# several batches can wait on the network at once
+_ai_loop = None
+_ai_loop_lock = Lock()
+
+# Batching limits for queued AI analysis requests
+MAX_BATCH = 8
+MAX_WAIT_MS = 200
+
+# Shared process pool for OCR, created on first use
+_POOL = None
+_POOL_LOCK = Lock()
+
+# Tesseract API instance owned by each OCR worker process (set by _init_worker)
+_API = None
+
+
+def extract_text_from_image(image_path: str, img: Optional[np.ndarray] = None) -> str:
     """
     Extract text from an image file using Tesseract OCR.
     
+    The image is binarized with Otsu thresholding before being OCR'd on the
+    shared worker pool.
+    
     Args:
         image_path: Path to the image file
+        img: Grayscale image already decoded by _load_ocr_image, so the file
+            is not decoded a second time
         
     Returns:
         Extracted text as a string
@@ -38,16 +174,182 @@ def extract_text_from_image(image_path: str) -> str:
         Exception: If OCR extraction fails
     """
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image)
-        return text.strip()
+        if img is None:
+            img = _decode_grayscale(image_path)
+        
+        _, img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        
+        # OCR on the shared worker pool, which keeps Tesseract initialized
+        _, png = cv2.imencode(".png", img)
+        try:
+            return _get_pool().submit(_ocr_one, png.tobytes()).result()
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
     except Exception as e:
         raise Exception(f"Failed to extract text from image: {str(e)}")
 
 
+def _decode_grayscale(image_path: str) -> np.ndarray:
+    """
+    Decode an image as grayscale, downscaled if it is larger than
+    MAX_IMAGE_DIMENSION so Tesseract scans fewer pixels.
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        # OpenCV cannot decode some formats (e.g. GIF); fall back to Pillow
+        with Image.open(image_path) as image:
+            img = np.array(image.convert("L"))
+    
+    h, w = img.shape
+    scale = min(1.0, MAX_IMAGE_DIMENSION / max(h, w))
+    if scale < 1:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _load_ocr_image(image_path: str) -> Optional[np.ndarray]:
+    """
+    Decode an image for OCR, or return None if it is not worth running OCR on.
+    
+    Rejects files that are not valid images, images smaller than
+    MIN_IMAGE_PIXELS (checked from the header, before decoding) and blank
+    or heavily blurred images whose Laplacian variance, measured on the
+    downscaled image, is below MIN_IMAGE_SHARPNESS. The returned grayscale
+    array can be passed straight to extract_text_from_image.
+    """
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+            image.verify()
+    except Exception:
+        return None
+    
+    if width * height < MIN_IMAGE_PIXELS:
+        return None
+    
+    img = _decode_grayscale(image_path)
+    if cv2.Laplacian(img, cv2.CV_64F).var() < MIN_IMAGE_SHARPNESS:
+        return None
+    return img
+
+
+def _init_worker() -> None:
+    """
+    Initialize an OCR worker process.
+    
+    Pins Tesseract to a single thread, creates the worker's Tesseract API
+    instance (reused for every page it processes) and runs one tiny OCR call
+    so the first real page does not pay the model loading cost.
+    """
+    global _API
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    try:
+        _API = PyTessBaseAPI(
+            lang=TESSERACT_LANG,
+            psm=TESSERACT_PSM,
+            oem=TESSERACT_OEM,
+            variables=TESSERACT_VARIABLES
+        )
+        # Pool workers leave via os._exit, which skips atexit handlers
+        multiprocessing.util.Finalize(None, _API.End, exitpriority=10)
+        _API.SetImage(Image.new("L", (1, 1), 255))
+        _API.GetUTF8Text()
+    except Exception as e:
+        print(f"OCR worker initialization failed: {str(e)}")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared OCR process pool, creating it on first use.
+    
+    Workers are started via forkserver rather than fork: the server process is
+    multithreaded and has gRPC/Firebase state that must not be copied into a child.
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ProcessPoolExecutor(
+                    max_workers=os.cpu_count(),
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_init_worker
+                )
+                atexit.register(_POOL.shutdown, wait=False)
+    return _POOL
+
+
+def _reset_pool() -> None:
+    """Discard a broken OCR process pool so the next request creates a new one."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False)
+            _POOL = None
+
+
+def _ocr_one(png_bytes: bytes) -> str:
+    """
+    Run Tesseract OCR on a single PNG-encoded image in a worker process.
+    
+    Defined at module level so it can be pickled into worker processes.
+    """
+    if _API is None:
+        raise Exception("Tesseract OCR is not available in this worker")
+    try:
+        _API.SetImage(Image.open(io.BytesIO(png_bytes)))
+        return _API.GetUTF8Text().strip()
+    except Exception as e:
+        # Re-raise as a plain Exception; errors that cannot be unpickled in the
+        # parent process would mark the whole pool as broken
+        raise Exception(str(e))
+
+
+def _text_layer(page) -> Optional[str]:
+    """
+    Return the embedded text of a born-digital PDF page, or None if the page
+    needs OCR (scanned page, or a text layer too short or too repetitive to
+    be real content).
+    """
+    text = page.get_text("text").strip()
+    if len(text) < MIN_TEXT_LAYER_CHARS:
+        return None
+    if len({ch for ch in text if ch.isalnum()}) < MIN_TEXT_LAYER_DISTINCT_CHARS:
+        return None
+    return text
+
+
+def _iter_page_chunks(doc, chunk_size: int = PDF_PAGE_CHUNK_SIZE) -> Iterator[List[Tuple[Optional[str], Optional[bytes]]]]:
+    """
+    Yield PDF pages chunk_size at a time as (text, png_bytes) pairs.
+    
+    Pages with a usable text layer carry their text and no image; all other
+    pages are rendered to grayscale PNG bytes for OCR. Only one chunk of
+    rendered pages is alive at once, so memory stays flat regardless of the
+    document's page count.
+    """
+    for start in range(0, len(doc), chunk_size):
+        chunk = []
+        for i in range(start, min(start + chunk_size, len(doc))):
+            page = doc[i]
+            page_text = _text_layer(page)
+            if page_text is not None:
+                chunk.append((page_text, None))
+                continue
+            
+            # Render page to grayscale at 150 DPI (enough for OCR, 4x fewer bytes than RGB)
+            pix = page.get_pixmap(dpi=PDF_RENDER_DPI, colorspace=fitz.csGRAY)
+            chunk.append((None, pix.tobytes("png")))
+        yield chunk
+
+
 def extract_text_from_pdf(pdf_path: str) -> str:
     """
-    Convert PDF to images and extract text from each page using OCR.
+    Extract text from each PDF page, using OCR only where needed.
+    
+    Born-digital pages use their embedded text layer directly. Remaining
+    pages are rendered as grayscale PNGs in chunks of PDF_PAGE_CHUNK_SIZE and
+    OCR'd in parallel across the shared process pool, one page per worker task.
     
     Args:
         pdf_path: Path to the PDF file
@@ -58,28 +360,328 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     Raises:
         Exception: If PDF conversion or text extraction fails
     """
+    doc = None
     try:
-        # Convert PDF to list of images (one per page)
-        images = convert_from_path(pdf_path)
+        doc = fitz.open(pdf_path)
+        
+        # OCR the scanned pages of each chunk in parallel; map() yields results in page order
+        page_texts = []
+        try:
+            for chunk in _iter_page_chunks(doc):
+                images = [png for _, png in chunk if png is not None]
+                ocr_texts = iter(_get_pool().map(_ocr_one, images))
+                for page_text, png in chunk:
+                    page_texts.append(page_text if png is None else next(ocr_texts))
+        except BrokenProcessPool:
+            _reset_pool()
+            raise
         
         all_text = []
-        for i, image in enumerate(images):
-            # Extract text from each page
-            page_text = pytesseract.image_to_string(image)
-            if page_text.strip():
-                all_text.append(f"--- Page {i+1} ---\n{page_text.strip()}")
+        for i, page_text in enumerate(page_texts):
+            if page_text:
+                all_text.append(f"--- Page {i+1} ---\n{page_text}")
         
         return "\n\n".join(all_text)
     except Exception as e:
         raise Exception(f"Failed to extract text from PDF: {str(e)}")
+    finally:
+        if doc is not None:
+            doc.close()
 
 
-def analyze_medical_text_with_ai(extracted_text: str) -> str:
+def _strip_running_headers(pages: List[List[str]]) -> None:
+    """
+    Remove running headers/footers from multi-page OCR output in place.
+    
+    A line counts as a running header (or footer) only if it is the first (or
+    last) content line of every page; it is kept on the first page and dropped
+    from the others. Lines anywhere else are never touched.
+    """
+    if len(pages) < 2:
+        return
+    
+    for edge in (0, -1):
+        edge_lines = set()
+        for page in pages:
+            content = [line for line in page if line]
+            edge_lines.add(content[edge] if content else None)
+        if len(edge_lines) != 1 or None in edge_lines:
+            continue
+        
+        for page in pages[1:]:
+            indexes = [i for i, line in enumerate(page) if line]
+            del page[indexes[edge]]
+
+
+def _normalize_ocr(text: str) -> str:
+    """
+    Compact raw OCR output before sending it to the AI model.
+    
+    Collapses runs of spaces/tabs and blank lines, drops short punctuation-only
+    lines (typical Tesseract noise) and removes headers/footers repeated at the
+    top or bottom of every "--- Page N ---" block.
+    """
+    text = re.sub(r"[ \t]+", " ", text)
+    
+    # Split into a preamble plus one list of content lines per page block
+    preamble = []
+    pages = []
+    page_markers = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if line and len(line) <= 2 and all(ch in string.punctuation for ch in line):
+            continue
+        if re.fullmatch(r"--- Page \d+ ---", line):
+            page_markers.append(line)
+            pages.append([])
+        elif pages:
+            pages[-1].append(line)
+        else:
+            preamble.append(line)
+    
+    _strip_running_headers(pages)
+    
+    lines = preamble
+    for marker, page in zip(page_markers, pages):
+        lines.append(marker)
+        lines.extend(page)
+    
+    text = "\n".join(lines)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def _get_ai_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop that runs Gemini requests, starting it in a daemon
+    thread on first use.
+    """
+    global _ai_loop
+    with _ai_loop_lock:
+        if _ai_loop is None:
+            _ai_loop = asyncio.new_event_loop()
+            Thread(target=_ai_loop.run_forever, name="ai-event-loop", daemon=True).start()
+        return _ai_loop
+
+
+async def _get_context_cache() -> Optional[str]:
+    """
+    Return the name of the Gemini context cache holding the system instruction
+    and prompt scaffold, creating it lazily and recreating it before it expires.
+    
+    Returns None if caching is disabled or the cache cannot be created (e.g. the
+    model does not support caching or the cached content is below the minimum
+    size), in which case callers send the full prompt inline. A failed creation
+    disables caching for the rest of the process.
+    """
+    global _context_cache_failed, _context_cache_name, _context_cache_expires_at
+    
+    if not CONTEXT_CACHE_ENABLED or _context_cache_failed:
+        return None
+    
+    async with _context_cache_lock:
+        now = time.monotonic()
+        if now < _context_cache_expires_at:
+            return _context_cache_name
+        
+        try:
+            cache = await client.aio.caches.create(
+                model=CONTEXT_CACHE_MODEL,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    contents=[PROMPT_TEMPLATE_PREFIX],
+                    ttl=f"{CONTEXT_CACHE_TTL_SECONDS}s"
+                )
+            )
+            _context_cache_name = cache.name
+            # Refresh a minute early so requests never reference an expired cache
+            _context_cache_expires_at = now + CONTEXT_CACHE_TTL_SECONDS - 60
+        except Exception as e:
+            print(f"Gemini context cache unavailable, disabling it: {str(e)}")
+            _context_cache_failed = True
+            _context_cache_name = None
+        
+        return _context_cache_name
+
+
+def _invalidate_context_cache() -> None:
+    """Force the context cache to be recreated on the next request."""
+    global _context_cache_name, _context_cache_expires_at
+    _context_cache_name = None
+    _context_cache_expires_at = 0.0
+
+
+async def _generate_content(document_prompt: str, max_output_tokens: int) -> types.GenerateContentResponse:
+    """
+    Send a document prompt to Gemini, referencing the cached system instruction
+    and prompt scaffold when available and inlining them otherwise.
+    """
+    cache_name = await _get_context_cache()
+    if cache_name:
+        try:
+            response = await client.aio.models.generate_content(
+                model=CONTEXT_CACHE_MODEL,
+                contents=document_prompt,
+                config=types.GenerateContentConfig(
+                    cached_content=cache_name,
+                    temperature=0.3,
+                    max_output_tokens=max_output_tokens
+                )
+            )
+            return response
+        except Exception as e:
+            if "cache" not in str(e).lower():
+                raise
+            # Cache was deleted or expired server-side; recreate it next time
+            print(f"Gemini context cache rejected, sending full prompt: {str(e)}")
+            _invalidate_context_cache()
+    
+    response = await client.aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=f"{PROMPT_TEMPLATE_PREFIX}\n\n{document_prompt}",
+        config=types.GenerateContentConfig(
+            system_instruction=SYSTEM_INSTRUCTION,
+            temperature=0.3,
+            max_output_tokens=max_output_tokens
+        )
+    )
+    return response
+
+
+async def _generate_single_analysis(extracted_text: str) -> Optional[str]:
+    """Analyze one medical text with a single Gemini request."""
+    response = await _generate_content(DOCUMENT_PROMPT.format(extracted_text=extracted_text), 2048)
+    return response.text or None
+
+
+def _is_truncated(response: types.GenerateContentResponse) -> bool:
+    """Return True if Gemini stopped generating because it hit max_output_tokens."""
+    return any(
+        candidate.finish_reason == types.FinishReason.MAX_TOKENS
+        for candidate in (response.candidates or [])
+    )
+
+
+async def _generate_analyses(texts: List[str]) -> List[Optional[str]]:
+    """
+    Analyze several medical texts with one Gemini request.
+    
+    Falls back to concurrent per-text requests if the batched response cannot
+    be split back into exactly one analysis per report.
+    """
+    if len(texts) == 1:
+        return [await _generate_single_analysis(texts[0])]
+    
+    reports = "\n\n".join(
+        f"Report {i+1}:\n{text}" for i, text in enumerate(texts)
+    )
+    response = await _generate_content(
+        BATCH_DOCUMENT_PROMPT.format(count=len(texts), separator=BATCH_SEPARATOR, reports=reports),
+        min(2048 * len(texts), 8192)
+    )
+    
+    # Every part must be a complete analysis: the response was not cut off and
+    # each part ends with its own disclaimer
+    analyses = [part.strip() for part in (response.text or "").split(BATCH_SEPARATOR)]
+    if (_is_truncated(response) or len(analyses) != len(texts)
+            or not all(AI_DISCLAIMER_MARKER in analysis.lower() for analysis in analyses)):
+        print(f"Batched AI response did not split into {len(texts)} complete analyses, retrying individually")
+        return list(await asyncio.gather(*[_generate_single_analysis(text) for text in texts]))
+    return analyses
+
+
+class _BatchAggregator:
+    """
+    Collects queued texts and hands them to an async handler in batches.
+    
+    Only texts submitted with the same batch key (the uploading user) are ever
+    batched together, so one prompt never mixes different patients' reports;
+    texts without a key are always sent on their own. A text is dispatched
+    immediately when no other text with its key is waiting; otherwise the
+    background thread keeps collecting same-key texts until it has max_batch
+    of them or max_wait_ms has elapsed. Each batch is scheduled on the AI event
+    loop without waiting for earlier batches to finish. Callers block on a
+    Future until their result (or the batch's exception) is set.
+    """
+    
+    def __init__(self, handler: Callable[[List[str]], Awaitable[List[Optional[str]]]],
+                 max_batch: int, max_wait_ms: int):
+        self._handler = handler
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._condition = Condition()
+        self._thread = None
+        self._lock = Lock()
+    
+    def submit(self, text: str, batch_key: Optional[str] = None) -> Optional[str]:
+        """Queue a text and block until its result is available."""
+        self._ensure_started()
+        future = Future()
+        with self._condition:
+            self._pending.append((batch_key, text, future))
+            self._condition.notify()
+        return future.result()
+    
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="ai-batcher", daemon=True)
+                self._thread.start()
+    
+    def _take_same_key(self, batch_key: str, batch: List[Tuple[str, Future]]) -> None:
+        """Move pending items with batch_key into batch, up to max_batch (caller holds the lock)."""
+        remaining = []
+        for item in self._pending:
+            if item[0] == batch_key and len(batch) < self._max_batch:
+                batch.append((item[1], item[2]))
+            else:
+                remaining.append(item)
+        self._pending = remaining
+    
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                
+                batch_key, text, future = self._pending.pop(0)
+                batch = [(text, future)]
+                
+                if batch_key is not None and any(item[0] == batch_key for item in self._pending):
+                    deadline = time.monotonic() + self._max_wait
+                    while True:
+                        self._take_same_key(batch_key, batch)
+                        remaining = deadline - time.monotonic()
+                        if len(batch) >= self._max_batch or remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+            
+            asyncio.run_coroutine_threadsafe(self._dispatch(batch), _get_ai_loop())
+    
+    async def _dispatch(self, batch: List[Tuple[str, Future]]) -> None:
+        try:
+            results = await self._handler([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+_ai_batcher = _BatchAggregator(_generate_analyses, MAX_BATCH, MAX_WAIT_MS)
+
+
+def analyze_medical_text_with_ai(extracted_text: str, batch_key: Optional[str] = None) -> str:
     """
     Analyze medical report text using Gemini AI and generate patient-friendly explanation.
     
     Args:
         extracted_text: The text extracted from medical report/prescription
+        batch_key: Identifies the uploading user; only texts with the same key
+            may share a batched Gemini request (None disables batching)
         
     Returns:
         AI-generated analysis in patient-friendly language
@@ -89,74 +691,77 @@ def analyze_medical_text_with_ai(extracted_text: str) -> str:
     """
     try:
         if not client:
-            return "⚠️ AI analysis is not available. GEMINI_API_KEY is not configured. Please set up the API key to enable AI-powered medical report analysis."
+            return AI_UNAVAILABLE_MESSAGE
         
         if not extracted_text or len(extracted_text.strip()) < 10:
-            return "Unable to analyze: insufficient text extracted from the document."
+            return INSUFFICIENT_TEXT_MESSAGE
+        
+        # Strip OCR whitespace and noise so more real content fits in the token budget
+        extracted_text = _normalize_ocr(extracted_text)
         
         # Limit input size to prevent token limit issues (roughly 15,000 characters ~ 4,000 tokens)
         MAX_CHARS = 15000
         if len(extracted_text) > MAX_CHARS:
             extracted_text = extracted_text[:MAX_CHARS] + "\n...[Text truncated due to length]"
         
-        # System instruction with safety disclaimer
-        system_instruction = """You are a medical AI assistant helping patients understand their medical reports and prescriptions.
-
-IMPORTANT DISCLAIMER: You must always include this in your response:
-"⚠️ This is an AI-generated analysis for informational purposes only. It is NOT medical advice. Always consult with your healthcare provider for proper interpretation and clinical decisions."
-
-Your role is to help patients understand their medical documents, not to diagnose or prescribe treatment."""
-
-        # Create detailed prompt for medical analysis
-        user_prompt = f"""Analyze the following medical text and provide a clear, patient-friendly explanation that includes:
-
-1. **Document Type**: Identify if this is a lab report, prescription, radiology report, etc.
-2. **Key Findings**: List the main test results, medications, or findings
-3. **Normal vs Abnormal**: Highlight any values that are outside normal ranges (if applicable)
-4. **Simple Explanation**: Explain what these results mean in simple, non-technical language
-5. **Recommendations**: Suggest next steps (e.g., "discuss with your doctor", "this appears normal")
-
-Medical Text:
-{extracted_text}
-
-Remember to include the important disclaimer at the end of your analysis."""
-
-        # Call Gemini AI with supported model and configuration
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=user_prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction,
-                temperature=0.3,
-                max_output_tokens=2048
-            )
-        )
+        # Return a cached analysis if this exact text was analyzed recently
+        cache_key = blake3(extracted_text.encode("utf-8")).digest(16)
+        with _AI_LOCK:
+            cached_analysis = _AI_CACHE.get(cache_key)
+        if cached_analysis is not None:
+            print(f"AI analysis cache hit: {cache_key.hex()}")
+            return cached_analysis
         
-        if response.text:
-            return response.text
+        # Queue the text for the next (possibly batched) Gemini request
+        analysis = _ai_batcher.submit(extracted_text, batch_key)
+        
+        if analysis:
+            with _AI_LOCK:
+                _AI_CACHE[cache_key] = analysis
+            print(f"AI analysis cache set: {cache_key.hex()}")
+            return analysis
         else:
-            return "AI analysis could not be generated. Please try again or consult your healthcare provider."
+            return NO_ANALYSIS_MESSAGE
             
     except Exception as e:
         error_msg = str(e).lower()
         # Handle common error cases with user-friendly messages
         if "quota" in error_msg or "rate" in error_msg:
-            return "Service temporarily unavailable due to high demand. Please try again in a few moments."
+            return RATE_LIMITED_MESSAGE
         elif "invalid" in error_msg and "api" in error_msg:
-            return "API configuration error. Please contact support."
+            return API_CONFIG_ERROR_MESSAGE
         elif "token" in error_msg or "length" in error_msg:
-            return "Document is too large to analyze. Please try a shorter document or split it into sections."
+            return DOCUMENT_TOO_LARGE_MESSAGE
         else:
             raise Exception(f"Failed to analyze medical text with AI: {str(e)}")
 
 
-def process_uploaded_file(file_path: str, file_extension: str) -> Tuple[str, str]:
+def is_generated_analysis(ai_analysis: str) -> bool:
+    """Return True if ai_analysis came from Gemini rather than being a fallback message."""
+    return bool(ai_analysis) and ai_analysis not in FALLBACK_ANALYSES
+
+
+def text_fingerprint(extracted_text: str) -> str:
+    """
+    Return a stable identity hash for extracted document text, used to
+    recognize re-uploads of the same document.
+    """
+    return blake3(extracted_text.encode("utf-8")).hexdigest(32)
+
+
+def process_uploaded_file(file_path: str, file_extension: str,
+                          find_existing_analysis: Optional[Callable[[str], Optional[str]]] = None,
+                          user_id: Optional[str] = None) -> Tuple[str, str]:
     """
     Process uploaded file (PDF or image) and return extracted text + AI analysis.
     
     Args:
         file_path: Path to the uploaded file
         file_extension: File extension (pdf, png, jpg, jpeg, gif)
+        find_existing_analysis: Optional lookup taking the text_fingerprint of the
+            extracted text and returning a previous analysis of the same text (or
+            None); when it returns one, AI analysis is skipped
+        user_id: Uploading user, so AI requests are only batched with the same user's reports
         
     Returns:
         Tuple of (extracted_text, ai_analysis)
@@ -169,7 +774,11 @@ def process_uploaded_file(file_path: str, file_extension: str) -> Tuple[str, str
         if file_extension.lower() == 'pdf':
             extracted_text = extract_text_from_pdf(file_path)
         elif file_extension.lower() in ['png', 'jpg', 'jpeg', 'gif']:
-            extracted_text = extract_text_from_image(file_path)
+            # Skip OCR entirely for tiny, blank or blurred images
+            img = _load_ocr_image(file_path)
+            if img is None:
+                return "", "The image is too small, blank or blurry to read. Please upload a clearer photo or scan of the document."
+            extracted_text = extract_text_from_image(file_path, img)
         else:
             raise Exception(f"Unsupported file type: {file_extension}")
         
@@ -177,8 +786,14 @@ def process_uploaded_file(file_path: str, file_extension: str) -> Tuple[str, str
         if not extracted_text or len(extracted_text.strip()) < 5:
             return "", "No readable text found in the document. Please ensure the image is clear and contains text."
         
+        # Reuse the analysis of a previously uploaded copy of this document
+        if find_existing_analysis:
+            existing_analysis = find_existing_analysis(text_fingerprint(extracted_text))
+            if existing_analysis:
+                return extracted_text, existing_analysis
+        
         # Get AI analysis of the extracted text
-        ai_analysis = analyze_medical_text_with_ai(extracted_text)
+        ai_analysis = analyze_medical_text_with_ai(extracted_text, user_id)
         
         return extracted_text, ai_analysis
         
@@ -5,7 +5,7 @@ const ReportList = ({ reports, onReportClick, showPatientInfo = false }) => {
 
   const filteredReports = reports.filter(report =>
     report.filename.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    (report.ai_analysis && report.ai_analysis.toLowerCase().includes(searchTerm.toLowerCase()))
+    (report.ai_preview && report.ai_preview.toLowerCase().includes(searchTerm.toLowerCase()))
   );
 
   const formatDate = (dateString) => {
@@ -89,9 +89,9 @@ const ReportList = ({ reports, onReportClick, showPatientInfo = false }) => {
                     </svg>
                     <span>{formatDate(report.uploaded_at)}</span>
                   </div>
-                  {report.ai_analysis && (
+                  {report.ai_preview && (
                     <p className="text-sm text-gray-700 line-clamp-2 leading-relaxed">
-                      {report.ai_analysis.substring(0, 150)}...
+                      {report.ai_preview}...
                     </p>
                   )}
                 </div>
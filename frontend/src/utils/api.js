@@ -16,6 +16,18 @@ api.interceptors.request.use(async (config) => {
   return config;
 });
 
+const POLL_INTERVAL_MS = 2000;
+const MAX_POLL_ATTEMPTS = 150; // give up after ~5 minutes
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Shape errors like axios errors so callers can read err.response.data.error
+const uploadError = (message) => {
+  const error = new Error(message);
+  error.response = { data: { error: message } };
+  return error;
+};
+
 export const uploadFile = async (file) => {
   const formData = new FormData();
   formData.append('file', file);
@@ -26,7 +38,21 @@ export const uploadFile = async (file) => {
     },
   });
   
-  return response.data;
+  // The backend processes uploads in the background; poll until the report is ready
+  const { report_id: reportId, user_id: userId } = response.data;
+  for (let attempt = 0; attempt < MAX_POLL_ATTEMPTS; attempt++) {
+    await sleep(POLL_INTERVAL_MS);
+    const { report } = await getReportDetail(reportId, userId);
+    
+    if (report.status === 'error') {
+      throw uploadError(report.error);
+    }
+    if (report.status !== 'processing') {
+      return report;
+    }
+  }
+  
+  throw uploadError('Processing is taking longer than expected. Please check your reports again later.');
 };
 
 export const getUserReports = async (userId, limit = 50) => {